@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""Generate and refresh bubble-card popup stacks in a Lovelace grid.
+
+Reads a rooms list (JSON), a popup template (YAML) and an existing Lovelace
+grid (YAML), then inserts or replaces one ``vertical-stack`` per room.  The
+template carries ``__AREA_NAME__``, ``__AREA_ID__``, ``__HASH__`` and an
+optional ``__ICON__`` placeholder; existing stacks are matched by name, hash
+or area so repeated runs are idempotent.
+
+Only the written grid needs round-trip fidelity (comments, quoting), so the
+input grid and template are parsed with the safe loader while the output is
+emitted through ruamel's round-trip dumper.
+"""
+
+from __future__ import annotations
+
+import argparse
+import difflib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+from collections import deque
+from collections.abc import MutableMapping
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from ruamel.yaml import YAML
+from ruamel.yaml.comments import CommentedMap, CommentedSeq
+from ruamel.yaml.error import YAMLError
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# Interned so placeholder comparisons hit CPython's pointer-equality fast
+# path once template leaves are interned in _normalise_template.
+PLACEHOLDER_AREA_NAME = sys.intern("__AREA_NAME__")
+PLACEHOLDER_AREA_ID = sys.intern("__AREA_ID__")
+PLACEHOLDER_HASH = sys.intern("__HASH__")
+PLACEHOLDER_ICON = sys.intern("__ICON__")
+
+REQUIRED_PLACEHOLDERS = (
+    PLACEHOLDER_AREA_NAME,
+    PLACEHOLDER_AREA_ID,
+    PLACEHOLDER_HASH,
+)
+
+_PLACEHOLDER_TOKENS = frozenset(REQUIRED_PLACEHOLDERS) | {PLACEHOLDER_ICON}
+
+# One pass over the template source finds all required tokens at once.
+_PLACEHOLDER_RE = re.compile(r"__(?:AREA_NAME|AREA_ID|HASH)__")
+
+ICON_MAP_ENV = "BUBBLE_POPUP_ICON_MAP"
+
+# Concrete container types seen in practice; isinstance against these is far
+# cheaper than the ABC checks (MutableMapping/MutableSequence) they replace.
+_MAP_TYPES = (dict, CommentedMap)
+_SEQ_TYPES = (list, CommentedSeq)
+
+_SLUG_TABLE = str.maketrans(
+    {"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss", " ": "_", "/": "_"}
+)
+_SLUG_DROP = re.compile(r"[^a-z0-9_]+")
+
+
+class StackMatch(NamedTuple):
+    """Result of looking up a room's stack in the grid."""
+
+    index: Optional[int]
+    duplicates: List[int]
+
+
+class RoomReport(NamedTuple):
+    """One line of the per-room summary printed after a run."""
+
+    room: str
+    area_id: str
+    action: str
+
+
+@lru_cache(maxsize=None)
+def _yaml_loader(typ: str = "rt", pretty: bool = False, indent: int = 2) -> YAML:
+    """Build a configured ruamel ``YAML`` instance, one per flag combination."""
+    yaml = YAML(typ=typ)
+    if typ == "rt":
+        yaml.preserve_quotes = True
+        yaml.default_flow_style = False
+        if pretty:
+            yaml.indent(mapping=indent, sequence=indent + 2, offset=indent)
+    return yaml
+
+
+def load_yaml_roundtrip(path: Path, typ: str = "rt") -> Any:
+    """Load a YAML document; pass ``typ="safe"`` for read-only inputs.
+
+    The file is read in one shot and handed to the scanner as a single
+    buffer instead of streaming through Python's buffered-IO layer.
+    """
+    return _yaml_loader(typ=typ).load(path.read_bytes())
+
+
+def save_yaml_roundtrip(data: Any, path: Path, pretty: bool = False, indent: int = 2) -> None:
+    """Write ``data`` with the round-trip dumper, preserving quoting."""
+    dumper = _yaml_loader(typ="rt", pretty=pretty, indent=indent)
+    with path.open("w", encoding="utf-8") as handle:
+        dumper.dump(data, handle)
+
+
+def _yaml_lines(data: Any, pretty: bool = False, indent: int = 2) -> List[str]:
+    """Dump ``data`` as a list of lines for diffing.
+
+    Keeping the snapshots as line lists lets the diff stream to stdout
+    without ever holding the joined before/after/diff strings at once.
+    """
+    dumper = _yaml_loader(typ="rt", pretty=pretty, indent=indent)
+    buffer = io.StringIO()
+    dumper.dump(data, buffer)
+    buffer.seek(0)
+    return buffer.readlines()
+
+
+def validate_template(path: Path) -> None:
+    """Check the template file for the required placeholders and valid YAML."""
+    text = path.read_text(encoding="utf-8")
+    found = set(_PLACEHOLDER_RE.findall(text))
+    missing = [token for token in REQUIRED_PLACEHOLDERS if token not in found]
+    if missing:
+        # Report before paying for the YAML parse; a missing placeholder is
+        # the common failure.
+        raise ValueError(
+            f"template {path} is missing placeholder(s): {', '.join(missing)}"
+        )
+    try:
+        _yaml_loader(typ="safe").load(text)
+    except YAMLError as exc:
+        raise ValueError(f"template {path} is not valid YAML: {exc}") from exc
+
+
+def _json_loads(raw: Any) -> Any:
+    """Decode JSON with orjson when installed, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def load_rooms(path: Path) -> List[str]:
+    """Load the rooms list and reject anything but non-empty strings."""
+    data = _json_loads(path.read_bytes())
+    if not isinstance(data, list):
+        raise ValueError(f"rooms file {path} must contain a JSON list")
+    rooms: List[str] = []
+    for entry in data:
+        if not isinstance(entry, str) or not entry.strip():
+            raise ValueError(f"rooms file {path} contains a non-string entry: {entry!r}")
+        rooms.append(entry.strip())
+    return rooms
+
+
+def _load_icon_map() -> Dict[str, str]:
+    """Read the optional room -> mdi icon mapping from the environment."""
+    raw = os.environ.get(ICON_MAP_ENV)
+    if not raw:
+        return {}
+    try:
+        data = _json_loads(raw)
+    except ValueError as exc:
+        # Both json.JSONDecodeError and orjson.JSONDecodeError are ValueErrors.
+        raise ValueError(f"{ICON_MAP_ENV} is not valid JSON: {exc}") from exc
+    if not isinstance(data, dict):
+        raise ValueError(f"{ICON_MAP_ENV} must contain a JSON object")
+    icon_map: Dict[str, str] = {}
+    for key, value in data.items():
+        if not isinstance(value, str):
+            raise ValueError(f"{ICON_MAP_ENV} has a non-string icon for {key!r}")
+        # Key by normalised room name so lookups survive casing/whitespace
+        # differences between the rooms file and the icon map.
+        icon_map[_normalise_room(key)] = value
+    return icon_map
+
+
+def slugify_area(name: str) -> str:
+    """Turn a room name into a Home Assistant style area id.
+
+    The umlaut and separator mapping runs through a prebuilt ``str.translate``
+    table and the disallowed characters are stripped with one precompiled
+    regex, keeping the per-character work in C.
+    """
+    return _SLUG_DROP.sub("", name.strip().lower().translate(_SLUG_TABLE))
+
+
+@lru_cache(maxsize=4096)
+def _normalise_room(value: str) -> str:
+    """Normalise a room name for matching; cached and interned so repeated
+    lookups on the same names reduce to a dict hit and pointer compares."""
+    return sys.intern(value.strip().casefold())
+
+
+def _normalise_template(node: Any) -> Any:
+    """Strip ruamel container types down to plain dicts, lists and scalars.
+
+    The template never needs round-trip fidelity, and ``_fast_clone`` relies
+    on exact ``dict``/``list`` types.
+    """
+    if isinstance(node, _MAP_TYPES):
+        return {key: _normalise_template(value) for key, value in node.items()}
+    if isinstance(node, _SEQ_TYPES):
+        return [_normalise_template(item) for item in node]
+    if type(node) is str and node in _PLACEHOLDER_TOKENS:
+        return sys.intern(node)
+    return node
+
+
+def _fast_clone(node: Any) -> Any:
+    """Clone a plain dict/list tree without ``copy.deepcopy``'s dispatch cost.
+
+    Scalars are immutable and returned as-is; the exact ``type`` checks skip
+    the memo dict and ``__reduce_ex__`` machinery that make ``deepcopy`` slow.
+    """
+    if type(node) is dict:
+        return {key: _fast_clone(value) for key, value in node.items()}
+    if type(node) is list:
+        return [_fast_clone(item) for item in node]
+    return node
+
+
+class TemplatePlan(NamedTuple):
+    """A normalised template plus a compiled filler for its slots.
+
+    ``fill`` is generated from the recorded paths at prepare time: a
+    straight-line function of direct subscript assignments specialised to
+    this template's shape.
+    """
+
+    template: Any
+    placeholders: List[Tuple[Tuple[Any, ...], str]]
+    area_paths: List[Tuple[Any, ...]]
+    fill: Any
+
+
+_TOKEN_PARAMS = {
+    PLACEHOLDER_AREA_NAME: "room",
+    PLACEHOLDER_AREA_ID: "area_id",
+    PLACEHOLDER_HASH: "hash_",
+    PLACEHOLDER_ICON: "icon",
+}
+
+
+def _compile_fill(
+    placeholders: List[Tuple[Tuple[Any, ...], str]],
+    area_paths: List[Tuple[Any, ...]],
+) -> Any:
+    """Emit and compile a straight-line slot filler for one template shape.
+
+    Each recorded path becomes one subscript assignment, so the per-room
+    call runs no walker, no isinstance checks and no token lookups.
+    """
+
+    def subscripts(path: Tuple[Any, ...]) -> str:
+        return "".join(f"[{step!r}]" for step in path)
+
+    lines = ["def _fill(clone, room, area_id, hash_, icon):"]
+    for path, token in placeholders:
+        if token == PLACEHOLDER_ICON:
+            # No icon known for this room: leave the placeholder in place.
+            lines.append("    if icon is not None:")
+            lines.append(f"        clone{subscripts(path)} = icon")
+        else:
+            lines.append(f"    clone{subscripts(path)} = {_TOKEN_PARAMS[token]}")
+    for path in area_paths:
+        lines.append(f"    clone{subscripts(path)} = area_id")
+    if len(lines) == 1:
+        lines.append("    pass")
+    namespace: Dict[str, Any] = {}
+    exec(compile("\n".join(lines), "<template-plan>", "exec"), {}, namespace)
+    return namespace["_fill"]
+
+
+def prepare_template(template: Any) -> TemplatePlan:
+    """Normalise the template and record where each placeholder lives.
+
+    One full DFS runs here, once; ``instantiate`` afterwards touches only the
+    recorded paths per room instead of re-scanning the whole tree. ``area``
+    keys and ``target.area_id`` entries are recorded as area slots alongside
+    the literal placeholder tokens.
+    """
+    template = _normalise_template(template)
+    placeholders: List[Tuple[Tuple[Any, ...], str]] = []
+    area_paths: List[Tuple[Any, ...]] = []
+    stack = deque([((), template)])
+    while stack:
+        path, current = stack.pop()
+        if type(current) is dict:
+            for key, value in current.items():
+                if isinstance(value, str):
+                    if key == "area":
+                        area_paths.append(path + (key,))
+                    elif value in _PLACEHOLDER_TOKENS:
+                        placeholders.append((path + (key,), value))
+                elif type(value) is dict:
+                    area_ref = value.get("area_id")
+                    if (
+                        key == "target"
+                        and isinstance(area_ref, str)
+                        and area_ref not in _PLACEHOLDER_TOKENS
+                    ):
+                        area_paths.append(path + (key, "area_id"))
+                    stack.append((path + (key,), value))
+                elif type(value) is list:
+                    stack.append((path + (key,), value))
+        elif type(current) is list:
+            for idx, item in enumerate(current):
+                if isinstance(item, str):
+                    if item in _PLACEHOLDER_TOKENS:
+                        placeholders.append((path + (idx,), item))
+                elif type(item) is dict or type(item) is list:
+                    stack.append((path + (idx,), item))
+    return TemplatePlan(
+        template, placeholders, area_paths, _compile_fill(placeholders, area_paths)
+    )
+
+
+def instantiate(
+    plan: TemplatePlan, room: str, area_id: str, icon_value: Optional[str] = None
+) -> Any:
+    """Clone the plan's template and run its compiled slot filler."""
+    clone = _fast_clone(plan.template)
+    plan.fill(clone, room, area_id, f"#{area_id}-popup", icon_value)
+    return clone
+
+
+def deep_apply_template(
+    template: Any, room: str, area_id: str, icon_value: Optional[str] = None
+) -> Any:
+    """Build one room's stack from an unprepared template (one-shot path)."""
+    return instantiate(prepare_template(template), room, area_id, icon_value)
+
+
+def _is_bubble_popup(stack: Any) -> bool:
+    """Return whether ``stack`` is a vertical-stack wrapping a bubble popup."""
+    if not isinstance(stack, _MAP_TYPES) or stack.get("type") != "vertical-stack":
+        return False
+    cards = stack.get("cards")
+    if not isinstance(cards, _SEQ_TYPES) or not cards:
+        return False
+    first = cards[0]
+    return (
+        isinstance(first, _MAP_TYPES)
+        and first.get("type") == "custom:bubble-card"
+        and first.get("card_type") == "pop-up"
+    )
+
+
+def _stack_area(stack: Any) -> Optional[str]:
+    """Return the area a popup stack points at.
+
+    The template only ever writes the area into a handful of shallow slots
+    on the second card (``target.area_id``, ``filter.include[*].area`` or
+    ``entities[*].area``), so a fixed lookup with early returns replaces
+    the old recursive descent over every value of the stack.
+    """
+    cards = stack.get("cards")
+    if not isinstance(cards, _SEQ_TYPES) or len(cards) < 2:
+        return None
+    second = cards[1]
+    if not isinstance(second, _MAP_TYPES):
+        return None
+    target = second.get("target")
+    if isinstance(target, _MAP_TYPES):
+        area_id = target.get("area_id")
+        if isinstance(area_id, str):
+            return area_id
+    include_filter = second.get("filter")
+    if isinstance(include_filter, _MAP_TYPES):
+        for entry in include_filter.get("include") or ():
+            if isinstance(entry, _MAP_TYPES):
+                area = entry.get("area")
+                if isinstance(area, str):
+                    return area
+    for entity in second.get("entities") or ():
+        if isinstance(entity, _MAP_TYPES):
+            area = entity.get("area")
+            if isinstance(area, str):
+                return area
+    return None
+
+
+MATCH_STRATEGIES = ("name", "hash", "area")
+
+
+def _index_stack(indices: Dict[str, Dict[str, List[int]]], stack: Any, idx: int) -> None:
+    """Record one bubble popup under its name, hash and area keys."""
+    if not _is_bubble_popup(stack):
+        return
+    first = stack["cards"][0]
+    name = first.get("name")
+    if isinstance(name, str):
+        indices["name"].setdefault(_normalise_room(name), []).append(idx)
+    hash_value = first.get("hash")
+    if isinstance(hash_value, str):
+        indices["hash"].setdefault(hash_value, []).append(idx)
+    area = _stack_area(stack)
+    if area is not None:
+        indices["area"].setdefault(area, []).append(idx)
+
+
+def _index_existing_stacks(cards: List[Any]) -> Dict[str, Dict[str, List[int]]]:
+    """Index all bubble popup stacks by name, hash and area in one scan.
+
+    Replaces the per-room linear rescan of the grid: ``process_rooms`` builds
+    this once and then resolves each room with a dict lookup.
+    """
+    indices: Dict[str, Dict[str, List[int]]] = {
+        strategy: {} for strategy in MATCH_STRATEGIES
+    }
+    for idx, stack in enumerate(cards):
+        _index_stack(indices, stack, idx)
+    return indices
+
+
+def _stack_key(strategy: str, room: str, area_id: str) -> str:
+    """The index key a room resolves to under the given strategy."""
+    if strategy == "name":
+        return _normalise_room(room)
+    if strategy == "hash":
+        return f"#{area_id}-popup"
+    return area_id
+
+
+def _index_lookup(
+    indices: Dict[str, Dict[str, List[int]]], strategy: str, key: str
+) -> StackMatch:
+    hits = indices[strategy].get(key)
+    if not hits:
+        return StackMatch(None, [])
+    return StackMatch(hits[0], hits[1:])
+
+
+def find_existing_stack(
+    cards: List[Any], room: str, area_id: str, strategy: str = "name"
+) -> StackMatch:
+    """Locate the stack belonging to ``room`` using the given match strategy.
+
+    One-shot helper; ``process_rooms`` keeps the index across rooms instead.
+    """
+    if strategy not in MATCH_STRATEGIES:
+        raise ValueError(f"unknown match strategy: {strategy}")
+    indices = _index_existing_stacks(cards)
+    return _index_lookup(indices, strategy, _stack_key(strategy, room, area_id))
+
+
+def process_rooms(
+    grid_data: MutableMapping,
+    rooms: List[str],
+    template: Any,
+    icon_map: Optional[Dict[str, str]] = None,
+    match_strategy: str = "name",
+) -> List[RoomReport]:
+    """Insert or replace one popup stack per room, returning a report list.
+
+    ``icon_map`` must be keyed by normalised room name (see ``_load_icon_map``).
+    """
+    if match_strategy not in MATCH_STRATEGIES:
+        raise ValueError(f"unknown match strategy: {match_strategy}")
+    cards = grid_data.setdefault("cards", [])
+    icon_map = icon_map or {}
+    plan = prepare_template(template)
+    indices = _index_existing_stacks(cards)
+    reports: List[RoomReport] = []
+    for room in rooms:
+        area_id = slugify_area(room)
+        icon_value = icon_map.get(_normalise_room(room))
+        match = _index_lookup(indices, match_strategy, _stack_key(match_strategy, room, area_id))
+        if match.index is None:
+            stack = instantiate(plan, room, area_id, icon_value)
+            cards.append(stack)
+            _index_stack(indices, stack, len(cards) - 1)
+            reports.append(RoomReport(room, area_id, "added"))
+        elif _stack_is_current(cards[match.index], room, area_id, icon_value):
+            reports.append(RoomReport(room, area_id, "unchanged"))
+        else:
+            cards[match.index] = instantiate(plan, room, area_id, icon_value)
+            reports.append(RoomReport(room, area_id, "replaced"))
+        for dup in match.duplicates:
+            reports.append(RoomReport(room, area_id, f"duplicate at index {dup}"))
+    return reports
+
+
+def _stack_is_current(stack: Any, room: str, area_id: str, icon_value: Optional[str]) -> bool:
+    """Whether an existing stack already carries the intended room values.
+
+    Checking the few fields instantiation would set lets re-runs skip the
+    clone-and-fill entirely for untouched rooms.
+    """
+    first = stack["cards"][0]
+    if first.get("name") != room or first.get("hash") != f"#{area_id}-popup":
+        return False
+    if icon_value is not None and first.get("icon") != icon_value:
+        return False
+    return _stack_area(stack) == area_id
+
+
+def compute_diff(
+    before_lines: Sequence[str], after_lines: Sequence[str]
+) -> Iterator[str]:
+    """Yield unified diff lines between two YAML dumps of the grid."""
+    return difflib.unified_diff(
+        before_lines, after_lines, fromfile="before", tofile="after"
+    )
+
+
+def _handle_backup(grid_in: Path) -> Path:
+    """Copy the input grid aside before it gets overwritten.
+
+    ``shutil.copyfile`` copies in-kernel (sendfile) instead of routing the
+    whole file through a Python bytes object.
+    """
+    backup_path = grid_in.with_suffix(grid_in.suffix + ".bak")
+    shutil.copyfile(grid_in, backup_path)
+    return backup_path
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Insert bubble-card popup stacks for each room into a Lovelace grid."
+    )
+    parser.add_argument("grid_in", type=Path, help="existing Lovelace grid YAML")
+    parser.add_argument("template", type=Path, help="popup stack template YAML")
+    parser.add_argument("rooms", type=Path, help="JSON list of room names")
+    parser.add_argument(
+        "-o", "--out", type=Path, default=None,
+        help="output grid path (default: stdout)",
+    )
+    parser.add_argument(
+        "--match", choices=("name", "hash", "area"), default="name",
+        help="strategy used to find a room's existing stack",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="print a unified diff instead of writing the grid",
+    )
+    parser.add_argument(
+        "--backup", action="store_true",
+        help="keep a .bak copy of the input grid before overwriting",
+    )
+    parser.add_argument(
+        "--pretty", action="store_true",
+        help="re-indent the emitted YAML",
+    )
+    parser.add_argument(
+        "--indent", type=int, default=2,
+        help="indent width used with --pretty",
+    )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _build_parser().parse_args(argv)
+    try:
+        validate_template(args.template)
+        template = load_yaml_roundtrip(args.template, typ="safe")
+        grid_data = load_yaml_roundtrip(args.grid_in, typ="safe")
+        rooms = load_rooms(args.rooms)
+        icon_map = _load_icon_map()
+    except (OSError, ValueError, YAMLError) as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    if not isinstance(grid_data, _MAP_TYPES):
+        print(f"error: grid {args.grid_in} must be a YAML mapping", file=sys.stderr)
+        return 1
+
+    if args.dry_run:
+        before_lines = _yaml_lines(grid_data, pretty=args.pretty, indent=args.indent)
+    reports = process_rooms(
+        grid_data, rooms, template, icon_map, match_strategy=args.match
+    )
+
+    if args.dry_run:
+        after_lines = _yaml_lines(grid_data, pretty=args.pretty, indent=args.indent)
+        sys.stdout.writelines(compute_diff(before_lines, after_lines))
+    else:
+        if args.backup:
+            backup_path = _handle_backup(args.grid_in)
+            print(f"backup written to {backup_path}", file=sys.stderr)
+        if args.out is not None:
+            save_yaml_roundtrip(grid_data, args.out, pretty=args.pretty, indent=args.indent)
+        else:
+            dumper = _yaml_loader(typ="rt", pretty=args.pretty, indent=args.indent)
+            dumper.dump(grid_data, sys.stdout)
+
+    for report in reports:
+        print(f"{report.room} ({report.area_id}): {report.action}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import json
+
+import pytest
+
+from generate_bubble_popups import (
+    compute_diff,
+    deep_apply_template,
+    find_existing_stack,
+    load_rooms,
+    main,
+    process_rooms,
+    slugify_area,
+    validate_template,
+)
+
+
+TEMPLATE = {
+    "type": "vertical-stack",
+    "cards": [
+        {
+            "type": "custom:bubble-card",
+            "card_type": "pop-up",
+            "name": "__AREA_NAME__",
+            "hash": "__HASH__",
+            "icon": "__ICON__",
+        },
+        {
+            "type": "custom:auto-entities",
+            "filter": {"include": [{"area": "__AREA_ID__"}]},
+            "card": {
+                "type": "custom:bubble-card",
+                "tap_action": {
+                    "action": "call-service",
+                    "target": {"area_id": "__AREA_ID__"},
+                },
+            },
+        },
+    ],
+}
+
+TEMPLATE_YAML = """\
+type: vertical-stack
+cards:
+  - type: custom:bubble-card
+    card_type: pop-up
+    name: __AREA_NAME__
+    hash: __HASH__
+    icon: __ICON__
+  - type: custom:auto-entities
+    filter:
+      include:
+        - area: __AREA_ID__
+"""
+
+
+def _fresh_template():
+    return json.loads(json.dumps(TEMPLATE))
+
+
+def test_slugify_area_basic():
+    assert slugify_area("Living Room") == "living_room"
+
+
+def test_slugify_area_umlauts_and_specials():
+    assert slugify_area(" Küche/Eßzimmer ") == "kueche_esszimmer"
+    assert slugify_area("Büro!") == "buero"
+
+
+def test_deep_apply_template_replaces_placeholders():
+    stack = deep_apply_template(_fresh_template(), "Kitchen", "kitchen", "mdi:stove")
+    first = stack["cards"][0]
+    assert first["name"] == "Kitchen"
+    assert first["hash"] == "#kitchen-popup"
+    assert first["icon"] == "mdi:stove"
+    assert stack["cards"][1]["filter"]["include"][0]["area"] == "kitchen"
+    assert stack["cards"][1]["card"]["tap_action"]["target"]["area_id"] == "kitchen"
+
+
+def test_deep_apply_template_does_not_mutate_template():
+    template = _fresh_template()
+    deep_apply_template(template, "Kitchen", "kitchen")
+    assert template["cards"][0]["name"] == "__AREA_NAME__"
+
+
+def test_find_existing_stack_by_name_is_case_insensitive():
+    grid = {"cards": []}
+    process_rooms(grid, ["Kitchen"], _fresh_template())
+    match = find_existing_stack(grid["cards"], "  kitchen ", "kitchen")
+    assert match.index == 0
+    assert match.duplicates == []
+
+
+def test_find_existing_stack_by_hash_and_area():
+    grid = {"cards": []}
+    process_rooms(grid, ["Kitchen"], _fresh_template())
+    assert find_existing_stack(grid["cards"], "Kitchen", "kitchen", "hash").index == 0
+    assert find_existing_stack(grid["cards"], "Kitchen", "kitchen", "area").index == 0
+    assert find_existing_stack(grid["cards"], "Other", "other", "hash").index is None
+
+
+def test_process_rooms_adds_and_replaces():
+    grid = {"cards": [{"type": "markdown", "content": "keep me"}]}
+    reports = process_rooms(grid, ["Kitchen", "Bedroom"], _fresh_template())
+    assert [r.action for r in reports] == ["added", "added"]
+    assert len(grid["cards"]) == 3
+    grid["cards"][1]["cards"][0]["hash"] = "#stale-popup"
+    reports = process_rooms(grid, ["Kitchen"], _fresh_template())
+    assert [r.action for r in reports] == ["replaced"]
+    assert grid["cards"][1]["cards"][0]["hash"] == "#kitchen-popup"
+    assert len(grid["cards"]) == 3
+    assert grid["cards"][0]["type"] == "markdown"
+
+
+def test_process_rooms_reports_unchanged_on_rerun():
+    grid = {"cards": []}
+    process_rooms(grid, ["Kitchen"], _fresh_template())
+    reports = process_rooms(grid, ["Kitchen"], _fresh_template())
+    assert [r.action for r in reports] == ["unchanged"]
+
+
+def test_process_rooms_is_idempotent():
+    grid = {"cards": []}
+    process_rooms(grid, ["Kitchen", "Living Room"], _fresh_template())
+    snapshot = json.loads(json.dumps(grid))
+    process_rooms(grid, ["Kitchen", "Living Room"], _fresh_template())
+    assert grid == snapshot
+
+
+def test_validate_template_rejects_missing_placeholder(tmp_path):
+    template_path = tmp_path / "template.yaml"
+    template_path.write_text(TEMPLATE_YAML.replace("__HASH__", "static"))
+    with pytest.raises(ValueError, match="__HASH__"):
+        validate_template(template_path)
+
+
+def test_load_rooms_rejects_non_strings(tmp_path):
+    rooms_path = tmp_path / "rooms.json"
+    rooms_path.write_text(json.dumps(["Kitchen", 7]))
+    with pytest.raises(ValueError):
+        load_rooms(rooms_path)
+
+
+def test_compute_diff_reports_changes():
+    assert list(compute_diff(["a: 1\n"], ["a: 1\n"])) == []
+    diff = "".join(compute_diff(["a: 1\n"], ["a: 2\n"]))
+    assert "-a: 1" in diff
+    assert "+a: 2" in diff
+
+
+def test_main_dry_run_leaves_grid_untouched(tmp_path, capsys):
+    grid_path = tmp_path / "grid.yaml"
+    grid_path.write_text("cards: []\n")
+    template_path = tmp_path / "template.yaml"
+    template_path.write_text(TEMPLATE_YAML)
+    rooms_path = tmp_path / "rooms.json"
+    rooms_path.write_text(json.dumps(["Kitchen"]))
+    assert main([str(grid_path), str(template_path), str(rooms_path), "--dry-run"]) == 0
+    assert "+" in capsys.readouterr().out
+    assert grid_path.read_text() == "cards: []\n"
+
+
+def test_main_writes_output(tmp_path, capsys):
+    grid_path = tmp_path / "grid.yaml"
+    grid_path.write_text("cards: []\n")
+    template_path = tmp_path / "template.yaml"
+    template_path.write_text(TEMPLATE_YAML)
+    rooms_path = tmp_path / "rooms.json"
+    rooms_path.write_text(json.dumps(["Kitchen"]))
+    out_path = tmp_path / "out.yaml"
+    assert main(
+        [str(grid_path), str(template_path), str(rooms_path), "-o", str(out_path)]
+    ) == 0
+    assert "#kitchen-popup" in out_path.read_text()
+    assert "Kitchen (kitchen): added" in capsys.readouterr().err